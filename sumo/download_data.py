@@ -1,93 +1,189 @@
+import functools
+import itertools
 import os
 import sqlite3
-from typing import List, Dict, Any, cast
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Dict, Any, Set, Tuple, cast
 import logging
 from tqdm import tqdm
 
 from sumo.bashos import bashos
 from datetime import datetime, timedelta
 
-from sumo.utils import fetch
+from sumo.utils import fetch, iter_fetch
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "sumo.db")
 SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "schema.sql")
 
+# WAL with synchronous=NORMAL only fsyncs on checkpoint rather than on every
+# commit, and the larger page cache/mmap keep the lookup indices in memory.
+PRAGMAS = """
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -65536;
+PRAGMA mmap_size = 268435456;
+"""
+
+
+# Bound-parameter limit of SQLite builds older than 3.32.
+MAX_VARIABLES = 999
+# Loads with at least this many new bashos rebuild the indices afterwards.
+BULK_LOAD_BASHOS = 10
+
+INSERT_BASHO_SQL = "INSERT INTO basho (id, name, start_date, end_date) VALUES (?, ?, ?, ?) ON CONFLICT (id) DO NOTHING"
+INSERT_RIKISHI_SQL = "INSERT OR IGNORE INTO rikishi (id, name, debut_date, birth_date) VALUES (?, ?, ?, ?)"
+# A day counts as loaded for a division once it has a bout between two rikishi
+# of that division, so a run interrupted part-way through a day still fetches
+# the divisions it missed.
+LOADED_DAYS_SQL = """
+SELECT DISTINCT CAST(m.basho_id AS TEXT), br1.division, m.day
+FROM match m
+JOIN basho_rikishi br1
+    ON br1.basho_id = m.basho_id AND br1.rikishi_id = m.rikishi1_id
+JOIN basho_rikishi br2
+    ON br2.basho_id = m.basho_id AND br2.rikishi_id = m.rikishi2_id
+WHERE br1.division = br2.division
+"""
+
+
+def _configure(conn: sqlite3.Connection) -> None:
+    conn.executescript(PRAGMAS)
+
+
+def connect() -> sqlite3.Connection:
+    # Large enough to keep every bulk_insert chunk shape prepared.
+    # Transactions are managed explicitly with transaction(), so the module's
+    # implicit BEGIN handling is turned off.
+    conn = sqlite3.connect(DB_PATH, cached_statements=256, isolation_level=None)
+    _configure(conn)
+    return conn
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection) -> Iterator[None]:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+@functools.lru_cache(maxsize=None)
+def _insert_sql(table: str, columns: Tuple[str, ...], n_rows: int) -> str:
+    values = ", ".join(["(" + ", ".join("?" * len(columns)) + ")"] * n_rows)
+    return f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES {values}"
+
+
+def bulk_insert(
+    conn: sqlite3.Connection,
+    table: str,
+    columns: List[str],
+    rows: Iterable[Tuple[Any, ...]],
+) -> None:
+    # Bind as many rows per statement as the parameter limit allows, so the
+    # statement is stepped once per chunk rather than once per row. Rows are
+    # consumed lazily, so only one chunk is held in memory at a time.
+    chunk_size = MAX_VARIABLES // len(columns)
+    rows = iter(rows)
+    while chunk := list(itertools.islice(rows, chunk_size)):
+        conn.execute(
+            _insert_sql(table, tuple(columns), len(chunk)),
+            [value for row in chunk for value in row],
+        )
+
+
+def drop_indices(conn: sqlite3.Connection) -> List[str]:
+    # Only the indices from the schema; those backing primary keys have no SQL.
+    indices = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+    ).fetchall()
+    for name, _ in indices:
+        conn.execute(f"DROP INDEX {name}")
+    return [sql for _, sql in indices]
+
 
 def init_db() -> None:
-    if not os.path.exists(DB_PATH):
-        with open(SCHEMA_PATH) as f:
-            schema = f.read()
-        conn = sqlite3.connect(DB_PATH)
-        conn.executescript(schema)
-        conn.close()
+    with open(SCHEMA_PATH) as f:
+        schema = f.read()
+    # The schema is idempotent, so this also adds new indices to existing
+    # databases.
+    conn = connect()
+    conn.executescript(schema)
+    conn.close()
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 
 
-def maybe_insert_basho(conn: sqlite3.Connection, basho_id: str) -> None:
-    exists = conn.execute("SELECT 1 FROM basho WHERE id = ?", (basho_id,)).fetchone()
-    if exists:
+def maybe_insert_basho(
+    conn: sqlite3.Connection, basho_id: str, loaded: Set[str]
+) -> None:
+    if basho_id in loaded:
         return
     basho = fetch(f"/basho/{basho_id}")
     conn.execute(
-        "INSERT OR IGNORE INTO basho (id, name, start_date, end_date) VALUES (?, ?, ?, ?)",
+        INSERT_BASHO_SQL,
         (basho_id, basho.get("location"), basho.get("startDate"), basho.get("endDate")),
     )
-    conn.commit()
 
 
 def maybe_insert_basho_rikishi(
-    conn: sqlite3.Connection, basho_id: str, division: str
+    conn: sqlite3.Connection,
+    basho_id: str,
+    divisions: List[str],
+    loaded: Set[Tuple[str, str]],
 ) -> None:
-    exists = conn.execute(
-        "SELECT 1 FROM basho_rikishi WHERE basho_id = ? AND division = ?",
-        (basho_id, division),
-    ).fetchone()
-    if exists:
-        return
-    data = fetch(f"/basho/{basho_id}/banzuke/{division}")
-    for side in ["east", "west"]:
-        if data[side] is None:
-            continue
-        for rikishi in data[side]:
-            conn.execute(
-                "INSERT OR IGNORE INTO basho_rikishi (basho_id, rikishi_id, rank, rank_value, division) VALUES (?, ?, ?, ?, ?)",
-                (
-                    basho_id,
-                    rikishi["rikishiID"],
-                    rikishi["rank"],
-                    rikishi["rankValue"],
-                    division,
-                ),
+    missing = [division for division in divisions if (basho_id, division) not in loaded]
+    paths = {f"/basho/{basho_id}/banzuke/{division}": division for division in missing}
+    for path, data in iter_fetch(list(paths)):
+        division = paths[path]
+        rows = (
+            (
+                basho_id,
+                rikishi["rikishiID"],
+                rikishi["rank"],
+                rikishi["rankValue"],
+                division,
             )
-            conn.commit()
+            for side in ["east", "west"]
+            if data[side] is not None
+            for rikishi in data[side]
+        )
+        bulk_insert(
+            conn,
+            "basho_rikishi",
+            ["basho_id", "rikishi_id", "rank", "rank_value", "division"],
+            rows,
+        )
 
 
 def maybe_insert_rikishi_details(conn: sqlite3.Connection, basho_id: str) -> None:
-    rikishi_this_basho = [
+    # Anti-join so only rikishi without details are returned, in one query.
+    missing_rikishi = [
         x[0]
         for x in conn.execute(
-            "SELECT rikishi_id FROM basho_rikishi WHERE basho_id = ?", (basho_id,)
+            """
+            SELECT br.rikishi_id FROM basho_rikishi br
+            LEFT JOIN rikishi r ON r.id = br.rikishi_id
+            WHERE br.basho_id = ? AND r.id IS NULL
+            """,
+            (basho_id,),
         ).fetchall()
     ]
-    for rikishi_id in tqdm(rikishi_this_basho, desc="Rikishi Details"):
-        already_exists = conn.execute(
-            "SELECT id FROM rikishi WHERE id = ?", (rikishi_id,)
-        ).fetchall()
-        if already_exists:
-            continue
-        data = fetch(f"/rikishi/{rikishi_id}")
-        conn.execute(
-            "INSERT OR IGNORE INTO rikishi (id, name, debut_date, birth_date) VALUES (?, ?, ?, ?)",
-            (
-                data.get("id"),
-                data.get("shikonaEn"),
-                data.get("debut"),
-                data.get("birthDate"),
-            ),
+    paths = [f"/rikishi/{rikishi_id}" for rikishi_id in missing_rikishi]
+    rows = (
+        (
+            data.get("id"),
+            data.get("shikonaEn"),
+            data.get("debut"),
+            data.get("birthDate"),
         )
-        conn.commit()
+        for _, data in tqdm(iter_fetch(paths), total=len(paths), desc="Rikishi Details")
+    )
+    conn.executemany(INSERT_RIKISHI_SQL, rows)
 
 
 def maybe_insert_measurements(conn: sqlite3.Connection, basho_id: str) -> None:
@@ -98,31 +194,39 @@ def maybe_insert_measurements(conn: sqlite3.Connection, basho_id: str) -> None:
     if exists:
         return
     measurements = cast(list[Any], fetch(f"/measurements?bashoId={basho_id}"))
-    measurements = [x for x in measurements if x["bashoId"] == basho_id]
-    for m in measurements:
-        conn.execute(
-            "INSERT OR IGNORE INTO measurement (rikishi_id, basho_id, height_cm, weight_kg) VALUES (?, ?, ?, ?)",
-            (
-                m.get("rikishiId"),
-                basho_id,
-                m.get("height"),
-                m.get("weight"),
-            ),
+    rows = (
+        (
+            m.get("rikishiId"),
+            basho_id,
+            m.get("height"),
+            m.get("weight"),
         )
-        conn.commit()
+        for m in measurements
+        if m["bashoId"] == basho_id
+    )
+    bulk_insert(
+        conn, "measurement", ["rikishi_id", "basho_id", "height_cm", "weight_kg"], rows
+    )
 
 
-def maybe_insert_matches(
-    conn: sqlite3.Connection, basho_id: str, division: str, day: int
+def insert_torikumi(
+    conn: sqlite3.Connection,
+    basho_id: str,
+    division_days: List[Tuple[str, int]],
+    match_dates: Tuple[datetime, ...],
 ) -> None:
-    row = conn.execute(
-        "SELECT start_date FROM basho WHERE id = ?", (basho_id,)
-    ).fetchone()
-    start_date = datetime.fromisoformat(row[0])
-    match_data: Dict[str, Any] = fetch(f"/basho/{basho_id}/torikumi/{division}/{day}")
-    for match in match_data.get("torikumi", []):
-        conn.execute(
-            "INSERT OR IGNORE INTO match (id, basho_id, rikishi1_id, rikishi2_id, winner_id, kimarite, day, match_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+    paths = {
+        f"/basho/{basho_id}/torikumi/{division}/{day}": (division, day)
+        for division, day in division_days
+    }
+    # Each day is written as soon as its response arrives, so the inserts
+    # overlap with the requests that are still in flight.
+    match_data: Dict[str, Any]
+    for path, match_data in iter_fetch(list(paths)):
+        division, day = paths[path]
+        match_date = match_dates[day - 1]
+        torikumi = match_data.get("torikumi") or []
+        rows = (
             (
                 match["id"],
                 basho_id,
@@ -131,15 +235,63 @@ def maybe_insert_matches(
                 match["winnerId"],
                 match["kimarite"],
                 day,
-                start_date + timedelta(days=day - 1),
-            ),
+                match_date,
+            )
+            for match in torikumi
+        )
+        bulk_insert(
+            conn,
+            "match",
+            [
+                "id",
+                "basho_id",
+                "rikishi1_id",
+                "rikishi2_id",
+                "winner_id",
+                "kimarite",
+                "day",
+                "match_date",
+            ],
+            rows,
         )
-        conn.commit()
+
+
+def maybe_insert_matches(
+    conn: sqlite3.Connection,
+    basho_id: str,
+    divisions: List[str],
+    loaded: Set[Tuple[str, str, int]],
+) -> None:
+    # A division with no banzuke rows for this basho has no bouts to fetch (a
+    # cancelled basho, or a division that didn't exist yet). A day without
+    # bouts is no such evidence: lower divisions only fight on some days.
+    ranked = {
+        row[0]
+        for row in conn.execute(
+            "SELECT DISTINCT division FROM basho_rikishi WHERE basho_id = ?",
+            (basho_id,),
+        )
+    }
+    division_days = [
+        (division, day)
+        for division in divisions
+        if division in ranked
+        for day in range(1, 16)
+        if (basho_id, division, day) not in loaded
+    ]
+    if not division_days:
+        return
+    row = conn.execute(
+        "SELECT start_date FROM basho WHERE id = ?", (basho_id,)
+    ).fetchone()
+    start_date = datetime.fromisoformat(row[0])
+    match_dates = tuple(start_date + timedelta(days=day) for day in range(15))
+    insert_torikumi(conn, basho_id, division_days, match_dates)
 
 
 def main(basho_ids: List[str]) -> None:
     init_db()
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect()
     divisions: List[str] = [
         "Makuuchi",
         "Juryo",
@@ -148,21 +300,40 @@ def main(basho_ids: List[str]) -> None:
         "Jonidan",
         "Jonokuchi",
     ]
+    # Read what is already stored once per run instead of probing again for
+    # every basho, division and day. Ids are stored as integers.
+    loaded_bashos = {
+        row[0] for row in conn.execute("SELECT CAST(id AS TEXT) FROM basho")
+    }
+    loaded_banzuke = set(
+        conn.execute(
+            "SELECT DISTINCT CAST(basho_id AS TEXT), division FROM basho_rikishi"
+        )
+    )
+    loaded_days = set(conn.execute(LOADED_DAYS_SQL))
+    # Updating every secondary index row by row dominates a large load, so
+    # they are dropped and built once at the end. Small incremental loads
+    # keep them in place. The basho row is written in the same transaction as
+    # the rest of the basho, so it marks bashos already loaded, including
+    # those without bouts.
+    new_bashos = set(basho_ids) - loaded_bashos
+    index_sql = drop_indices(conn) if len(new_bashos) >= BULK_LOAD_BASHOS else []
     logging.info(f"Starting to process {len(basho_ids)} bashos...")
-    for basho_id in tqdm(basho_ids, desc="Bashos"):
-        maybe_insert_basho(conn, basho_id)
-        for division in tqdm(divisions, desc=f"Divisions for {basho_id}", leave=False):
-            maybe_insert_basho_rikishi(conn, basho_id, division)
-
-        maybe_insert_rikishi_details(conn, basho_id)
-        maybe_insert_measurements(conn, basho_id)
-
-        for division in tqdm(
-            divisions, desc=f"Match Divisions {basho_id}", leave=False
-        ):
-            for day in tqdm(range(1, 16), desc=f"Days {division}", leave=False):
-                maybe_insert_matches(conn, basho_id, division, day)
-    conn.commit()
+    try:
+        for basho_id in tqdm(basho_ids, desc="Bashos"):
+            # One transaction per basho: a single fsync on commit instead of
+            # one per row, while still persisting progress at basho boundaries.
+            with transaction(conn):
+                maybe_insert_basho(conn, basho_id, loaded_bashos)
+                maybe_insert_basho_rikishi(conn, basho_id, divisions, loaded_banzuke)
+                maybe_insert_rikishi_details(conn, basho_id)
+                maybe_insert_measurements(conn, basho_id)
+                maybe_insert_matches(conn, basho_id, divisions, loaded_days)
+    finally:
+        for sql in index_sql:
+            conn.execute(sql)
+    # Refresh planner statistics now that the tables have grown.
+    conn.execute("ANALYZE")
     conn.close()
 
 
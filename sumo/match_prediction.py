@@ -1,19 +1,42 @@
+import functools
+import math
 import sqlite3
-from collections import defaultdict
-from typing import DefaultDict
+from itertools import chain, starmap, takewhile
+from typing import Iterable
 from dataclasses import dataclass
 from tqdm import tqdm
 import xgboost as xgb
+from numba import njit, prange
 from sklearn.metrics import accuracy_score
 import numpy as np
+import pandas as pd
 from abc import ABC, abstractmethod
 from tabulate import tabulate
 
 
 DB_PATH = "sumo/sumo.db"
+# 10 ** (x / 400) == exp(x * LN10_OVER_400), a single exp call.
+LN10_OVER_400 = math.log(10) / 400
+# This module only reads, so it sets no pragma that writes to the file:
+# journal_mode is left to the downloader, and synchronous would only matter for
+# writes (OFF risks corrupting the file the downloader fills).
+PRAGMAS = """
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -65536;
+PRAGMA mmap_size = 268435456;
+"""
+
+
+# One connection per database for the whole run, so its page cache stays warm
+# and the schema is parsed once.
+@functools.lru_cache(maxsize=4)
+def _conn(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path)
+    conn.executescript(PRAGMAS)
+    return conn
 
 
-@dataclass
+@dataclass(slots=True)
 class Match:
     id: str
     basho_id: int
@@ -30,42 +53,52 @@ class Match:
 
 
 def load_matches_and_basho_dates(db_path: str) -> tuple[list[Match], dict[int, str]]:
-    conn = sqlite3.connect(db_path)
+    conn = _conn(db_path)
     c = conn.cursor()
-    # Get basho dates
-    c.execute("SELECT id, start_date FROM basho")
-    basho_dates = {row[0]: row[1] for row in c.fetchall()}
-    # Get matches with height/weight for each rikishi in that basho
-    matches = []
-    for basho_id in tqdm(
-        sorted(basho_dates.keys()), desc="Loading matches", total=len(basho_dates)
-    ):
+    # Both queries read from one snapshot.
+    c.execute("BEGIN")
+    try:
+        # Get basho dates
+        c.execute("SELECT id, start_date FROM basho")
+        basho_dates = {row[0]: row[1] for row in c.fetchall()}
+        # Get matches with height/weight for each rikishi in that basho, in
+        # chronological order: basho ids are YYYYMM, so the (basho_id, day) index
+        # already yields them sorted.
+        matches = []
+        # Rows are pulled from SQLite in large batches rather than one at a time.
+        c.arraysize = 10000
         c.execute(
-            f"""
+            """
             SELECT m.id, m.basho_id, m.rikishi1_id, m.rikishi2_id, m.winner_id, m.day,
                    m1.height_cm, m1.weight_kg, m2.height_cm, m2.weight_kg, br1.rank_value, br2.rank_value
             FROM match m
-        LEFT JOIN measurement m1 ON m.rikishi1_id = m1.rikishi_id AND m.basho_id = m1.basho_id
-        LEFT JOIN measurement m2 ON m.rikishi2_id = m2.rikishi_id AND m.basho_id = m2.basho_id
-        LEFT JOIN basho_rikishi br1 ON m.rikishi1_id = br1.rikishi_id AND m.basho_id = br1.basho_id
-        LEFT JOIN basho_rikishi br2 ON m.rikishi2_id = br2.rikishi_id AND m.basho_id = br2.basho_id
-        WHERE m.basho_id = {basho_id}
-        """
+            LEFT JOIN measurement m1 ON m.rikishi1_id = m1.rikishi_id AND m.basho_id = m1.basho_id
+            LEFT JOIN measurement m2 ON m.rikishi2_id = m2.rikishi_id AND m.basho_id = m2.basho_id
+            LEFT JOIN basho_rikishi br1 ON m.rikishi1_id = br1.rikishi_id AND m.basho_id = br1.basho_id
+            LEFT JOIN basho_rikishi br2 ON m.rikishi2_id = br2.rikishi_id AND m.basho_id = br2.basho_id
+            ORDER BY m.basho_id, m.day
+            """
         )
-        matches.extend(
-            sorted([Match(*row) for row in c.fetchall()], key=lambda x: x.day)
-        )
-    conn.close()
+        with tqdm(desc="Loading matches", unit=" matches") as progress:
+            while rows := c.fetchmany():
+                matches.extend(starmap(Match, rows))
+                progress.update(len(rows))
+    finally:
+        # The connection is shared, so the read transaction must end even if
+        # loading is interrupted; otherwise the next BEGIN on it fails.
+        c.close()
+        conn.rollback()
     return matches, basho_dates
 
 
 def train_test_split(
     matches: list[Match], basho_dates: dict[int, str], split_date: str
 ) -> tuple[list[Match], list[Match]]:
+    # Dates are per basho, so compare them once per basho rather than per match.
+    train_ids = frozenset(b for b, date in basho_dates.items() if date < split_date)
     train, test = [], []
     for m in matches:
-        date = basho_dates[m.basho_id]
-        if date < split_date:
+        if m.basho_id in train_ids:
             train.append(m)
         else:
             test.append(m)
@@ -86,60 +119,239 @@ class BaseModel(ABC):
         pass
 
 
+class RatingStore:
+    # idx maps rikishi ids to slots in ratings. ratings is a plain list so the
+    # per-match Python path reads and writes floats without NumPy scalar
+    # boxing; the Numba kernels work on an array gathered from it and
+    # scattered back.
+    __slots__ = ("idx", "ratings")
+
+    def __init__(self):
+        self.idx: dict[int, int] = {}
+        self.ratings: list[float] = []
+
+    def as_dict(self) -> dict[int, float]:
+        return dict(zip(self.idx, self.ratings))
+
+    def index(self, rikishi: int) -> int:
+        i = self.idx.get(rikishi)
+        if i is None:
+            i = self.idx[rikishi] = len(self.ratings)
+            self.ratings.append(1500.0)
+        return i
+
+    def indices(self, rikishi_ids: Iterable[int]) -> np.ndarray:
+        return np.array([self.index(r) for r in rikishi_ids], dtype=np.intp)
+
+    def gather(self, idx: np.ndarray) -> np.ndarray:
+        return np.array(self.ratings)[idx]
+
+    def scatter(self, idx: np.ndarray, values: np.ndarray) -> None:
+        ratings = self.ratings
+        for i, value in zip(idx.tolist(), values.tolist()):
+            ratings[i] = value
+
+
 class EloModel(BaseModel):
     def __init__(self, K: float):
-        self.stats: DefaultDict[int, float] = defaultdict(lambda: 1500)
+        self.store = RatingStore()
         self.K = K
 
+    @property
+    def stats(self) -> dict[int, float]:
+        return self.store.as_dict()
+
+    def rating(self, rikishi: int) -> float:
+        i = self.store.idx.get(rikishi)
+        return 1500.0 if i is None else self.store.ratings[i]
+
     def fit(self, matches: list[Match]) -> float:
         return self.evaluate(matches)
 
     def predict(self, rikishi1: int, rikishi2: int) -> int:
-        mean1 = self.stats[rikishi1]
-        mean2 = self.stats[rikishi2]
+        idx = self.store.idx
+        ratings = self.store.ratings
+        i1 = idx.get(rikishi1)
+        i2 = idx.get(rikishi2)
+        mean1 = 1500.0 if i1 is None else ratings[i1]
+        mean2 = 1500.0 if i2 is None else ratings[i2]
         return rikishi1 if mean1 > mean2 else rikishi2
 
     def update(self, rikishi1: int, rikishi2: int, winner: int) -> None:
-        mean1 = self.stats[rikishi1]
-        mean2 = self.stats[rikishi2]
-
-        exp1 = 1 / (1 + 10 ** ((mean2 - mean1) / 400))
+        # Lookups are inlined here and in predict: this is the per-match path
+        # of the pure-Python Elo loops.
+        store = self.store
+        idx = store.idx
+        i1 = idx.get(rikishi1)
+        if i1 is None:
+            i1 = store.index(rikishi1)
+        i2 = idx.get(rikishi2)
+        if i2 is None:
+            i2 = store.index(rikishi2)
+        ratings = store.ratings
+        mean1 = ratings[i1]
+        mean2 = ratings[i2]
+
+        exp1 = 1 / (1 + math.exp((mean2 - mean1) * LN10_OVER_400))
         exp2 = 1 - exp1
-        s1 = 1 if winner == rikishi1 else 0
+        s1 = float(winner == rikishi1)
         s2 = 1 - s1
 
         new_mean1 = mean1 + self.K * (s1 - exp1)
         new_mean2 = mean2 + self.K * (s2 - exp2)
-        self.stats[rikishi1] = new_mean1
-        self.stats[rikishi2] = new_mean2
+        ratings[i1] = new_mean1
+        ratings[i2] = new_mean2
+
+    def fit_only(self, matches: list[Match]) -> None:
+        # Advances the ratings like evaluate, minus the prediction bookkeeping.
+        id_to_idx, r1, r2, w = build_id_index(matches)
+        idx = self.store.indices(id_to_idx)
+        ratings = self.store.gather(idx)
+        elo_updates(r1, r2, w, ratings, self.K)
+        self.store.scatter(idx, ratings)
 
     def evaluate(self, matches: list[Match]) -> float:
-        # Use a fresh model for evaluation
-        correct = 0
-        for m in sort_matches(matches):
-            pred = self.predict(m.rikishi1_id, m.rikishi2_id)
-            if pred == m.winner_id:
-                correct += 1
-            self.update(m.rikishi1_id, m.rikishi2_id, m.winner_id)
-        return correct / len(matches) if matches else 0
+        return evaluate_elo_models([self], matches)[0]
 
     def name(self) -> str:
         return f"Elo({self.K})"
 
 
+def build_id_index(
+    matches: list[Match],
+) -> tuple[dict[int, int], np.ndarray, np.ndarray, np.ndarray]:
+    # Map rikishi ids to dense indices, in order of first appearance.
+    id_to_idx: dict[int, int] = {}
+    r1 = np.fromiter(
+        (id_to_idx.setdefault(m.rikishi1_id, len(id_to_idx)) for m in matches),
+        dtype=np.int32,
+        count=len(matches),
+    )
+    r2 = np.fromiter(
+        (id_to_idx.setdefault(m.rikishi2_id, len(id_to_idx)) for m in matches),
+        dtype=np.int32,
+        count=len(matches),
+    )
+    w = np.fromiter(
+        (m.winner_id == m.rikishi1_id for m in matches),
+        dtype=np.uint8,
+        count=len(matches),
+    )
+    return id_to_idx, r1, r2, w
+
+
+def evaluate_elo_models(models: list[EloModel], matches: list[Match]) -> list[float]:
+    # Every model sees the same matches in the same order, so they are all
+    # advanced by one kernel call over shared arrays, with one ratings row per model.
+    # Matches must already be in chronological order (see sort_matches).
+    id_to_idx, r1, r2, w = build_id_index(matches)
+    Ks = np.array([model.K for model in models], dtype=np.float64)
+    stores = [model.store for model in models]
+    slots = [store.indices(id_to_idx) for store in stores]
+    ratings = np.stack([store.gather(idx) for store, idx in zip(stores, slots)])
+    # w alone can't tell a rikishi2 win from a bout with no recorded winner
+    # (winner_id 0 or NULL), which never counts as a correct prediction.
+    w2 = np.fromiter(
+        (m.winner_id == m.rikishi2_id for m in matches),
+        dtype=np.uint8,
+        count=len(matches),
+    )
+    correct = elo_sweep(r1, r2, w, w2, ratings, Ks)
+    for store, idx, row in zip(stores, slots, ratings):
+        store.scatter(idx, row)
+    return [c / len(matches) if matches else 0 for c in correct.tolist()]
+
+
+@njit(cache=True, fastmath=True, parallel=True)
+def elo_sweep(
+    r1: np.ndarray,
+    r2: np.ndarray,
+    w: np.ndarray,
+    w2: np.ndarray,
+    ratings: np.ndarray,
+    Ks: np.ndarray,
+) -> np.ndarray:
+    # Same maths as EloModel.predict/update, over rating indices, for each K
+    # at once; updates ratings in place and returns correct predictions per K.
+    # Each K owns one row of ratings, so the Ks run on separate threads. w and
+    # w2 are 0/1, so scores and hits come from arithmetic rather than branches.
+    correct = np.zeros(Ks.shape[0], dtype=np.int64)
+    for k in prange(Ks.shape[0]):
+        row = ratings[k]
+        K = Ks[k]
+        for i in range(r1.shape[0]):
+            i1 = r1[i]
+            i2 = r2[i]
+            s1 = float(w[i])
+            s2 = 1 - s1
+            mean1 = row[i1]
+            mean2 = row[i2]
+            correct[k] += (mean1 > mean2) * w[i] + (mean1 <= mean2) * w2[i]
+
+            exp1 = 1 / (1 + math.exp((mean2 - mean1) * LN10_OVER_400))
+            exp2 = 1 - exp1
+
+            row[i1] = mean1 + K * (s1 - exp1)
+            row[i2] = mean2 + K * (s2 - exp2)
+    return correct
+
+
+@njit(cache=True, fastmath=True)
+def elo_updates(
+    r1: np.ndarray, r2: np.ndarray, w: np.ndarray, ratings: np.ndarray, K: float
+) -> None:
+    # elo_sweep for a single K, updating ratings in place without predicting.
+    for i in range(r1.shape[0]):
+        i1 = r1[i]
+        i2 = r2[i]
+        s1 = float(w[i])
+        s2 = 1 - s1
+        mean1 = ratings[i1]
+        mean2 = ratings[i2]
+
+        exp1 = 1 / (1 + math.exp((mean2 - mean1) * LN10_OVER_400))
+        exp2 = 1 - exp1
+
+        ratings[i1] = mean1 + K * (s1 - exp1)
+        ratings[i2] = mean2 + K * (s2 - exp2)
+
+
 class XGBoostModel(BaseModel):
     def __init__(self):
-        self.model = xgb.XGBClassifier(eval_metric="logloss")
+        # Rikishi ids are labels, not quantities: the categorical splitter
+        # partitions them directly instead of sweeping numeric split points.
+        self.model = xgb.XGBClassifier(
+            eval_metric="logloss", enable_categorical=True, tree_method="hist"
+        )
+        self.rikishi_ids = pd.CategoricalDtype([])
+        # The matches fit was last called with, and their features, so that
+        # evaluating on the training set doesn't extract them again.
+        self.fitted: tuple[list[Match], pd.DataFrame, np.ndarray] | None = None
+
+    def frame(self, X: np.ndarray) -> pd.DataFrame:
+        df = pd.DataFrame(X, columns=FEATURES)
+        # Both id columns share the categories seen in training, so codes line
+        # up between fit and evaluate; unseen ids become missing values.
+        for column in FEATURES[:2]:
+            df[column] = df[column].astype(np.int64).astype(self.rikishi_ids)
+        return df
 
     def fit(self, matches: list[Match]) -> float:
         X, y = extract_features(matches)
+        self.rikishi_ids = pd.CategoricalDtype(np.unique(X[:, :2]).astype(np.int64))
+        X = self.frame(X)
+        self.fitted = (matches, X, y)
         self.model.fit(X, y)
         y_pred = self.model.predict(X)
         acc = float(accuracy_score(y, y_pred))
         return acc
 
     def evaluate(self, matches: list[Match]) -> float:
-        X, y = extract_features(matches)
+        if self.fitted is not None and self.fitted[0] is matches:
+            _, X, y = self.fitted
+        else:
+            X, y = extract_features(matches)
+            X = self.frame(X)
         y_pred = self.model.predict(X)
         acc = float(accuracy_score(y, y_pred))
         return acc
@@ -157,42 +369,63 @@ def sort_matches(matches: list[Match]) -> list[Match]:
     return matches
 
 
+FEATURES = [
+    "rikishi1_id",
+    "rikishi2_id",
+    "rikishi1_height",
+    "rikishi1_weight",
+    "rikishi2_height",
+    "rikishi2_weight",
+]
+
+
 def extract_features(matches: list[Match]) -> tuple[np.ndarray, np.ndarray]:
-    # Features: rikishi1_id, rikishi2_id, rikishi1_height, rikishi1_weight, rikishi2_height, rikishi2_weight
-    X = np.array(
-        [
-            [
+    # Columns are FEATURES, in order.
+    # Values are streamed straight into one preallocated buffer, without a
+    # Python list per row or a dtype inference pass.
+    X = np.fromiter(
+        chain.from_iterable(
+            (
                 m.rikishi1_id,
                 m.rikishi2_id,
                 m.rikishi1_height if m.rikishi1_height is not None else 0,
                 m.rikishi1_weight if m.rikishi1_weight is not None else 0,
                 m.rikishi2_height if m.rikishi2_height is not None else 0,
                 m.rikishi2_weight if m.rikishi2_weight is not None else 0,
-            ]
+            )
             for m in matches
-        ]
+        ),
+        dtype=np.float64,
+        count=6 * len(matches),
+    ).reshape(len(matches), 6)
+    y = np.fromiter(
+        (m.winner_id == m.rikishi1_id for m in matches), dtype=int, count=len(matches)
     )
-    y = np.array([m.winner_id == m.rikishi1_id for m in matches], dtype=int)
     return X, y
 
 
 if __name__ == "__main__":
     matches, basho_dates = load_matches_and_basho_dates(DB_PATH)
+    # Checked once here; the models rely on this order rather than re-checking.
+    sort_matches(matches)
     split_date = "2023-01-01"
     train, test = train_test_split(matches, basho_dates, split_date)
 
-    models: list[BaseModel] = [
+    models: list[EloModel] = [
         EloModel(K=8),
         EloModel(K=16),
         EloModel(K=32),
         EloModel(K=64),
         EloModel(K=128),
     ]
-    accs = {}
-    for model in tqdm(models, desc="Training models"):
-        train_accuracy = model.fit(train)
-        test_accuracy = model.evaluate(test)
-        accs[model.name()] = (train_accuracy, test_accuracy)
+    train_accuracies = evaluate_elo_models(models, train)
+    test_accuracies = evaluate_elo_models(models, test)
+    accs = {
+        model.name(): (train_accuracy, test_accuracy)
+        for model, train_accuracy, test_accuracy in zip(
+            models, train_accuracies, test_accuracies
+        )
+    }
 
     print(f"Train/test split: {len(train)}/{len(test)} matches")
     rows = [
@@ -210,12 +443,11 @@ if __name__ == "__main__":
     )
     rikishi_names = {}
     name_query = "SELECT id, name FROM rikishi"
-    conn = sqlite3.connect(DB_PATH)
+    conn = _conn(DB_PATH)
     c = conn.cursor()
     c.execute(name_query)
     for row in c.fetchall():
         rikishi_names[row[0]] = row[1]
-    conn.close()
     elos = sorted(models[3].stats.items(), key=lambda x: x[1], reverse=True)
     for rank, (rikishi_id, elo) in enumerate(elos[:50], start=1):
         print(f"{rank:2d}. {rikishi_names[rikishi_id]:20s} {elo:.1f}")
@@ -237,7 +469,7 @@ def aggregate_basho_stats(matches, elo_model):
         for rikishi_id, rank in [(m.rikishi1_id, m.rikishi1_rank), (m.rikishi2_id, m.rikishi2_rank)]:
             key = (m.basho_id, rikishi_id)
             if key not in first_match:
-                first_match[key] = (rank, elo_model.stats[rikishi_id])
+                first_match[key] = (rank, elo_model.rating(rikishi_id))
         # Update net wins
         if m.winner_id == m.rikishi1_id:
             net_wins[(m.basho_id, m.rikishi1_id)] += 1
@@ -283,13 +515,12 @@ plt.show()
 
 # --- Predict wins for makuuchi rikishi in the most recent basho ---
 def get_makuuchi_rikishi_for_basho(basho_id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = _conn(DB_PATH)
     c = conn.cursor()
     c.execute("""
         SELECT rikishi_id, rank_value FROM basho_rikishi
         WHERE basho_id = ? AND division = 'Makuuchi'""", (basho_id,))
     result = c.fetchall()
-    conn.close()
     return result  # list of (rikishi_id, rank_value)
 
 # Find the most recent basho
@@ -298,14 +529,13 @@ makuuchi_rikishi = get_makuuchi_rikishi_for_basho(latest_basho_id)
 
 # Get starting Elo for each rikishi in that basho (using Elo after all previous matches)
 elo_model = EloModel(K=64)
-for m in sort_matches(matches):
-    if m.basho_id == latest_basho_id:
-        break
-    elo_model.update(m.rikishi1_id, m.rikishi2_id, m.winner_id)
+elo_model.fit_only(
+    list(takewhile(lambda m: m.basho_id != latest_basho_id, sort_matches(matches)))
+)
 
 rows = []
 for rikishi_id, rank_value in makuuchi_rikishi:
-    starting_elo = elo_model.stats[rikishi_id]
+    starting_elo = elo_model.rating(rikishi_id)
     X_pred = np.array([[rank_value, starting_elo]])
     pred_wins = reg.predict(X_pred)[0]
     name = rikishi_names.get(rikishi_id, str(rikishi_id))
@@ -1,18 +1,18 @@
-CREATE TABLE basho (
+CREATE TABLE IF NOT EXISTS basho (
     id INTEGER PRIMARY KEY,
     name TEXT,
     start_date DATE,
     end_date DATE
 );
 
-CREATE TABLE rikishi (
+CREATE TABLE IF NOT EXISTS rikishi (
     id INTEGER PRIMARY KEY,
     name TEXT,
     debut_date DATE,
     birth_date DATE
 );
 
-CREATE TABLE measurement (
+CREATE TABLE IF NOT EXISTS measurement (
     rikishi_id INTEGER,
     basho_id INTEGER,
     height_cm INTEGER,
@@ -22,7 +22,7 @@ CREATE TABLE measurement (
     PRIMARY KEY (basho_id, rikishi_id)
 );
 
-CREATE TABLE basho_rikishi (
+CREATE TABLE IF NOT EXISTS basho_rikishi (
     basho_id INTEGER,
     rikishi_id INTEGER,
     rank TEXT,
@@ -34,7 +34,7 @@ CREATE TABLE basho_rikishi (
 );
 
 -- Table for Matches
-CREATE TABLE match (
+CREATE TABLE IF NOT EXISTS match (
     id TEXT PRIMARY KEY,
     basho_id INTEGER,
     rikishi1_id INTEGER,
@@ -50,12 +50,13 @@ CREATE TABLE match (
 );
 
 -- Indices to improve join/query performance
-CREATE INDEX idx_measurement_rikishi_id ON measurement(rikishi_id);
-CREATE INDEX idx_measurement_basho_id ON measurement(basho_id);
-CREATE INDEX idx_basho_rikishi_basho_id ON basho_rikishi(basho_id);
-CREATE INDEX idx_basho_rikishi_rikishi_id ON basho_rikishi(rikishi_id);
-CREATE INDEX idx_match_basho_id ON match(basho_id);
-CREATE INDEX idx_match_rikishi1_id ON match(rikishi1_id);
-CREATE INDEX idx_match_rikishi2_id ON match(rikishi2_id);
-CREATE INDEX idx_match_winner_id ON match(winner_id);
-CREATE INDEX idx_match_basho_day ON match (basho_id, day);
+CREATE INDEX IF NOT EXISTS idx_measurement_rikishi_id ON measurement(rikishi_id);
+CREATE INDEX IF NOT EXISTS idx_measurement_basho_id ON measurement(basho_id);
+CREATE INDEX IF NOT EXISTS idx_basho_rikishi_basho_id ON basho_rikishi(basho_id);
+CREATE INDEX IF NOT EXISTS idx_basho_rikishi_rikishi_id ON basho_rikishi(rikishi_id);
+CREATE INDEX IF NOT EXISTS idx_basho_rikishi_basho_division ON basho_rikishi(basho_id, division);
+CREATE INDEX IF NOT EXISTS idx_match_basho_id ON match(basho_id);
+CREATE INDEX IF NOT EXISTS idx_match_rikishi1_id ON match(rikishi1_id);
+CREATE INDEX IF NOT EXISTS idx_match_rikishi2_id ON match(rikishi2_id);
+CREATE INDEX IF NOT EXISTS idx_match_winner_id ON match(winner_id);
+CREATE INDEX IF NOT EXISTS idx_match_basho_day ON match (basho_id, day);
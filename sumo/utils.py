@@ -1,23 +1,87 @@
-import json
+import atexit
+import functools
 import os
-from typing import Any, Dict
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Tuple
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 BASE_URL = "https://www.sumo-api.com/api"
 CACHE_PATH = ".cache"
+MAX_WORKERS = 16
+# (connect, read) seconds, so a stalled connection is retried rather than hanging.
+TIMEOUT = (3.05, 30)
 
+# One pooled session so TCP/TLS connections are reused across requests.
+# pool_block makes extra threads wait for a kept-alive connection instead of
+# opening (and then discarding) one-off connections beyond the pool size.
+_session = requests.Session()
+_session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=MAX_WORKERS,
+        pool_maxsize=MAX_WORKERS,
+        pool_block=True,
+        max_retries=Retry(
+            total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]
+        ),
+    ),
+)
+atexit.register(_session.close)
+# Shared by every iter_fetch call so worker threads are started once per run
+# rather than once per batch.
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
 
-def fetch(path: str) -> Dict[str, Any]:
+
+def _fetch_raw(path: str) -> Dict[str, Any]:
     url = f"{BASE_URL}{path}"
     cache_path = os.path.join(CACHE_PATH, path.removeprefix("/") + ".json")
     if os.path.exists(cache_path):
-        with open(cache_path) as f:
-            return json.load(f)
-    response = requests.get(url)
+        with open(cache_path, "rb") as f:
+            return orjson.loads(f.read())
+    response = _session.get(url, timeout=TIMEOUT)
     if response.status_code == 200:
+        data = orjson.loads(response.content)
         os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-        with open(cache_path, "w") as f:
-            json.dump(response.json(), f)
-        return response.json()
+        # The body is already JSON, so cache it as-is instead of re-encoding.
+        # It is renamed into place so that an interrupted run never leaves a
+        # truncated entry that would break the next one.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(response.content)
+        os.replace(tmp_path, cache_path)
+        return data
     else:
         raise ValueError(f"Failed to fetch data in URL: {url}")
+
+
+# Repeated requests for a path within one run skip the stat and re-parse of
+# its cache file. Callers share the returned dict, so they must not mutate it.
+# Kept small so that one-off payloads (e.g. per-basho measurements) aren't
+# pinned for the whole run.
+@functools.lru_cache(maxsize=128)
+def fetch(path: str) -> Dict[str, Any]:
+    return _fetch_raw(path)
+
+
+def iter_fetch(paths: List[str]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    # Requests are network-bound, so a thread pool overlaps their latency.
+    # Results are yielded as they complete, letting the caller process one
+    # response while the others are still being downloaded. Batches are
+    # one-off, so they bypass fetch's in-memory cache and are freed once the
+    # caller is done with them.
+    futures = {_executor.submit(_fetch_raw, path): path for path in paths}
+    try:
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        # Don't leave queued requests running if the caller stops early.
+        for future in futures:
+            future.cancel()
+
+
+def fetch_many(paths: List[str]) -> Dict[str, Dict[str, Any]]:
+    return dict(iter_fetch(paths))